@@ -1,11 +1,124 @@
 """
 Production logging configuration for TradieMate Marketing Analytics Platform
 """
+import copy
+import glob
 import logging
+import queue
+import socket
 import sys
-from typing import Dict, Any
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Any, List, Optional, Tuple
 import os
 
+import orjson
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single-line JSON objects"""
+    
+    def __init__(self, datefmt: Optional[str] = None, static_fields: Optional[Dict[str, Any]] = None):
+        super().__init__(datefmt=datefmt)
+        # Fields that never change are encoded once and prefixed to every record
+        static = orjson.dumps(static_fields or {}).decode()
+        self._prefix = static[:-1] + "," if static != "{}" else "{"
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "function": record.funcName,
+            "line": record.lineno,
+            "message": record.getMessage()
+        }
+        
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        
+        return self._prefix + orjson.dumps(entry).decode()[1:]
+
+class BackgroundRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler that renumbers backup files on a background thread
+    
+    Rollover only moves the full log file aside and reopens it; shifting the
+    older backups happens on a single worker thread, in rollover order, so
+    the thread writing log records does not wait on it.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._rotations = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-rotation")
+        
+        # Finish rotations a previous process rolled over but never renumbered,
+        # oldest first, so their records are not lost or overwritten
+        if self.backupCount > 0:
+            for pending in sorted(self._claim_leftovers(), key=os.path.getmtime):
+                self._rotations.submit(self._shift_backups, pending)
+    
+    def _claim_leftovers(self) -> List[str]:
+        """
+        Take ownership of pending rotation files left behind by other processes
+        
+        Several processes can open the same log file (reloader and worker,
+        multiple workers). Each leftover is renamed to a name only this
+        process knows before it is shifted, so exactly one process shifts it.
+        
+        Returns:
+            List[str]: Paths of the leftovers claimed by this handler
+        """
+        claimed = []
+        for leftover in glob.glob(glob.escape(self.baseFilename) + ".rotating.*"):
+            recovering = f"{self.baseFilename}.recovering.{uuid.uuid4().hex}"
+            try:
+                os.rename(leftover, recovering)
+            except FileNotFoundError:
+                continue  # Claimed by another process first
+            claimed.append(recovering)
+        return claimed
+    
+    def doRollover(self) -> None:
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        if self.backupCount > 0 and os.path.exists(self.baseFilename):
+            # Unique across processes, so a leftover from a crash is never reused
+            pending = f"{self.baseFilename}.rotating.{uuid.uuid4().hex}"
+            os.rename(self.baseFilename, pending)
+            self._rotations.submit(self._shift_backups, pending)
+        if not self.delay:
+            self.stream = self._open()
+    
+    def _shift_backups(self, pending: str) -> None:
+        """Renumber existing backups and move the rolled-over file to .1"""
+        if not os.path.exists(pending):
+            # Recovered by another process; shifting again would drop a backup
+            return
+        try:
+            for i in range(self.backupCount - 1, 0, -1):
+                source = self.rotation_filename(f"{self.baseFilename}.{i}")
+                dest = self.rotation_filename(f"{self.baseFilename}.{i + 1}")
+                if os.path.exists(source):
+                    if os.path.exists(dest):
+                        os.remove(dest)
+                    os.rename(source, dest)
+            dest = self.rotation_filename(self.baseFilename + ".1")
+            if os.path.exists(dest):
+                os.remove(dest)
+            self.rotate(pending, dest)
+        except OSError as e:
+            sys.stderr.write(f"Log rotation failed for {self.baseFilename}: {e}\n")
+    
+    def close(self) -> None:
+        super().close()
+        self._rotations.shutdown(wait=True)
+
 def setup_logging() -> Dict[str, Any]:
     """
     Setup production-ready logging configuration
@@ -31,8 +144,13 @@ def setup_logging() -> Dict[str, Any]:
                 "datefmt": "%Y-%m-%d %H:%M:%S"
             },
             "json": {
-                "format": '{"timestamp": "%(asctime)s", "level": "%(levelname)s", "logger": "%(name)s", "module": "%(module)s", "function": "%(funcName)s", "line": %(lineno)d, "message": "%(message)s"}',
-                "datefmt": "%Y-%m-%d %H:%M:%S"
+                "()": JsonFormatter,
+                "datefmt": "%Y-%m-%d %H:%M:%S",
+                "static_fields": {
+                    "service": "tradie-marketing-analytics",
+                    "environment": environment,
+                    "host": socket.gethostname()
+                }
             }
         },
         "handlers": {
@@ -43,7 +161,7 @@ def setup_logging() -> Dict[str, Any]:
                 "stream": sys.stdout
             },
             "error_file": {
-                "class": "logging.handlers.RotatingFileHandler",
+                "()": BackgroundRotatingFileHandler,
                 "level": "ERROR",
                 "formatter": "detailed",
                 "filename": "logs/error.log",
@@ -51,12 +169,19 @@ def setup_logging() -> Dict[str, Any]:
                 "backupCount": 5
             },
             "app_file": {
-                "class": "logging.handlers.RotatingFileHandler",
+                "()": BackgroundRotatingFileHandler,
                 "level": log_level,
                 "formatter": "detailed",
                 "filename": "logs/app.log",
                 "maxBytes": 10485760,  # 10MB
                 "backupCount": 5
+            },
+            "app_file_buffered": {
+                "class": "logging.handlers.MemoryHandler",
+                "level": log_level,
+                "capacity": 512,
+                "flushLevel": logging.ERROR,
+                "target": "app_file"
             }
         },
         "loggers": {
@@ -82,24 +207,29 @@ def setup_logging() -> Dict[str, Any]:
             },
             "fastapi": {
                 "level": "INFO",
-                "handlers": ["console", "app_file"],
+                "handlers": ["console", "app_file_buffered"],
                 "propagate": False
             },
             "crewai": {
                 "level": "INFO",
-                "handlers": ["console", "app_file"],
+                "handlers": ["console", "app_file_buffered"],
                 "propagate": False
             },
             "tradie_marketing": {  # Application logger
                 "level": log_level,
-                "handlers": ["console", "app_file", "error_file"],
+                "handlers": ["console", "app_file_buffered", "error_file"],
                 "propagate": False
             }
         }
     }
     
-    # Create logs directory if it doesn't exist
-    os.makedirs("logs", exist_ok=True)
+    if environment == "test":
+        # Tests don't write log files
+        for name in ("error_file", "app_file"):
+            config["handlers"][name] = {"class": "logging.NullHandler"}
+    else:
+        # Create logs directory if it doesn't exist
+        os.makedirs("logs", exist_ok=True)
     
     return config
 
@@ -113,4 +243,100 @@ def get_logger(name: str) -> logging.Logger:
     Returns:
         logging.Logger: Configured logger instance
     """
-    return logging.getLogger(f"tradie_marketing.{name}")
\ No newline at end of file
+    return logging.getLogger(f"tradie_marketing.{name}")
+
+# Queued in place of a record to make the listener flush buffered handlers
+_FLUSH_BUFFERS = object()
+
+# Formats tracebacks of queued records before they leave the logging thread
+_traceback_formatter = logging.Formatter()
+
+class RoutingQueueHandler(QueueHandler):
+    """Queue handler that tags records with its logger's original handlers"""
+    
+    def __init__(self, log_queue: queue.SimpleQueue, targets: Tuple[logging.Handler, ...]):
+        super().__init__(log_queue)
+        self.targets = targets
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike QueueHandler.prepare, keep the traceback in exc_text (formatted
+        # here, while exc_info is still live) instead of folding it into msg, so
+        # each target's formatter decides where it goes
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = _traceback_formatter.formatException(record.exc_info)
+        
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = exc_text
+        record.log_targets = self.targets
+        return record
+
+class RoutingQueueListener(QueueListener):
+    """Queue listener that dispatches each record to the handlers it was tagged with"""
+    
+    def __init__(self, log_queue: queue.SimpleQueue, routes: Dict[str, Tuple[logging.Handler, ...]]):
+        handlers = tuple(dict.fromkeys(h for targets in routes.values() for h in targets))
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.routes = routes
+    
+    def handle(self, record: logging.LogRecord) -> None:
+        if record is _FLUSH_BUFFERS:
+            self.flush_buffers()
+            return
+        
+        record = self.prepare(record)
+        for handler in record.log_targets:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+    
+    def request_flush(self) -> None:
+        """Ask the listener thread to flush buffered handlers"""
+        self.queue.put_nowait(_FLUSH_BUFFERS)
+    
+    def flush_buffers(self) -> None:
+        """Write out records held by buffered handlers"""
+        for handler in self.handlers:
+            if isinstance(handler, MemoryHandler):
+                handler.flush()
+
+def start_log_listener(config: Dict[str, Any]) -> RoutingQueueListener:
+    """
+    Move the configured loggers' handlers behind a queue
+    
+    Log calls then only enqueue the record, while a single listener thread
+    formats it and writes it to the console and log files.
+    
+    Args:
+        config: Logging configuration returned by setup_logging
+        
+    Returns:
+        RoutingQueueListener: Started listener, to be passed to stop_log_listener
+    """
+    log_queue = queue.SimpleQueue()
+    routes = {}
+    
+    for name in config["loggers"]:
+        logger = logging.getLogger(name)
+        routes[name] = tuple(logger.handlers)
+        logger.handlers = [RoutingQueueHandler(log_queue, routes[name])]
+    
+    listener = RoutingQueueListener(log_queue, routes)
+    listener.start()
+    return listener
+
+def stop_log_listener(listener: RoutingQueueListener) -> None:
+    """
+    Reattach the loggers' own handlers and drain the queue
+    
+    Args:
+        listener: Listener returned by start_log_listener
+    """
+    for name, handlers in listener.routes.items():
+        logging.getLogger(name).handlers = list(handlers)
+    
+    listener.stop()
+    listener.flush_buffers()
@@ -1,53 +1,105 @@
 from fastapi import FastAPI, HTTPException, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, validator
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, field_validator
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from cai import run_crew_query
 import uvicorn
 import os
+import orjson
 import logging.config
 from typing import Dict, Any, Optional
 from dotenv import load_dotenv
 import time
+import random
+import asyncio
+from datetime import datetime, timezone
 from contextlib import asynccontextmanager
+from functools import lru_cache
 
 # Import production configurations
-from logging_config import setup_logging, get_logger
-from security_config import SecurityConfig, APIKeyAuth, RateLimiter, get_security_headers, validate_query_input
+from logging_config import setup_logging, get_logger, start_log_listener, stop_log_listener
+from security_config import get_security_config, APIKeyAuth, RateLimiter, SECURITY_HEADERS_RAW, SECURITY_HEADER_NAMES, validate_query_input
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Setup logging
-logging.config.dictConfig(setup_logging())
+logging_settings = setup_logging()
+logging.config.dictConfig(logging_settings)
 logger = get_logger(__name__)
 
+# Environment variables required to process queries; checked once after
+# .env is loaded since the environment does not change at runtime
+REQUIRED_ENV_VARS = ("OPENAI_API_KEY", "NEO4J_URI", "NEO4J_USERNAME", "NEO4J_PASSWORD")
+missing_env_vars = tuple(var for var in REQUIRED_ENV_VARS if not os.getenv(var))
+
 # Initialize security components
-security_config = SecurityConfig()
+security_config = get_security_config()
 api_key_auth = APIKeyAuth(auto_error=False)
 rate_limiter = RateLimiter()
 
+# How often idle clients are dropped from the rate limiter (seconds)
+RATE_LIMIT_PRUNE_INTERVAL = 60
+
+# How often buffered log records are written out (seconds)
+LOG_FLUSH_INTERVAL = 1
+
+async def run_periodically(interval: float, func) -> None:
+    """Call func every interval seconds until cancelled"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            func()
+        except Exception:
+            # Keep the schedule running; a failed pass is retried next interval
+            logger.exception(f"Periodic task {getattr(func, '__qualname__', func)} failed")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan events"""
     # Startup
+    log_listener = start_log_listener(logging_settings)
     logger.info("Starting TradieMate Marketing Analytics Platform")
     logger.info(f"Environment: {os.getenv('ENVIRONMENT', 'development')}")
     logger.info(f"Port: {os.getenv('PORT', '12000')}")
+    background_tasks = [
+        asyncio.create_task(run_periodically(RATE_LIMIT_PRUNE_INTERVAL, rate_limiter.prune)),
+        asyncio.create_task(run_periodically(LOG_FLUSH_INTERVAL, log_listener.request_flush)),
+    ]
     
     yield
     
     # Shutdown
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
     logger.info("Shutting down TradieMate Marketing Analytics Platform")
+    stop_log_listener(log_listener)
+
+# Last formatted timestamp, keyed by the whole second it was built for
+_timestamp_cache = [0, ""]
+
+def now_iso() -> str:
+    """Current UTC time as an ISO 8601 string, formatted at most once per second"""
+    second = int(time.time())
+    if second != _timestamp_cache[0]:
+        _timestamp_cache[:] = [
+            second,
+            datetime.fromtimestamp(second, timezone.utc).isoformat(timespec="seconds")
+        ]
+    return _timestamp_cache[1]
 
 class QueryRequest(BaseModel):
     query: str
     
-    @validator('query')
-    def validate_query(cls, v):
-        if not validate_query_input(v):
+    @field_validator('query')
+    @classmethod
+    def validate_query(cls, v: str) -> str:
+        query = v.strip()
+        if not validate_query_input(query):
             raise ValueError('Invalid query input')
-        return v.strip()
+        return query
 
 class HealthResponse(BaseModel):
     status: str
@@ -65,7 +117,8 @@ app = FastAPI(
     title="TradieMate Marketing Analytics Platform",
     description="A FastAPI server that uses CrewAI and Neo4j MCP to analyze Google Ads campaigns and website performance data, providing actionable optimization recommendations for trade businesses",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Configure CORS
@@ -78,55 +131,93 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Security headers middleware
-@app.middleware("http")
-async def add_security_headers(request: Request, call_next):
-    """Add security headers to all responses"""
-    response = await call_next(request)
-    
-    # Add security headers
-    for header, value in get_security_headers().items():
-        response.headers[header] = value
-    
-    return response
+# Canned rate limit response, sent as-is on every rejection
+_RATE_LIMIT_BODY = orjson.dumps(
+    {"error": "Rate limit exceeded", "detail": "Too many requests"}
+)
+_RATE_LIMIT_START = {
+    "type": "http.response.start",
+    "status": 429,
+    "headers": (
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(_RATE_LIMIT_BODY)).encode()),
+    ),
+}
+_RATE_LIMIT_RESPONSE_BODY = {"type": "http.response.body", "body": _RATE_LIMIT_BODY}
 
-# Rate limiting middleware
-@app.middleware("http")
-async def rate_limit_middleware(request: Request, call_next):
-    """Rate limiting middleware"""
-    client_ip = request.client.host
-    
-    if not rate_limiter.is_allowed(client_ip):
-        logger.warning(f"Rate limit exceeded for IP: {security_config.hash_sensitive_data(client_ip)}")
-        return JSONResponse(
-            status_code=429,
-            content={"error": "Rate limit exceeded", "detail": "Too many requests"}
-        )
-    
-    response = await call_next(request)
-    return response
-
-# Request logging middleware
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    """Log all requests"""
-    start_time = time.time()
-    
-    # Log request
-    logger.info(f"Request: {request.method} {request.url.path}")
+@lru_cache(maxsize=4096)
+def client_fingerprint(client_ip: str) -> str:
+    """Log-safe client IP hash, cached so repeat offenders are hashed once"""
+    return security_config.hash_sensitive_data(client_ip)
+
+# Low-value endpoints (probes, info) whose request logs are sampled
+LOG_SAMPLED_PATHS = frozenset({"/health", "/"})
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+
+# Request pipeline middleware
+class RequestPipelineMiddleware:
+    """Log requests, enforce rate limits and add security headers in one pass
     
-    response = await call_next(request)
+    Rate-limited requests are still logged but, as before, are answered
+    without security headers.
+    """
     
-    # Log response
-    process_time = time.time() - start_time
-    logger.info(f"Response: {response.status_code} - {process_time:.3f}s")
+    def __init__(self, app: ASGIApp):
+        self.app = app
     
-    return response
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        start_time = time.perf_counter()
+        status_code = None
+        
+        # Log request, sampling low-value endpoints
+        log_request = (
+            scope["path"] not in LOG_SAMPLED_PATHS or random.random() < LOG_SAMPLE_RATE
+        )
+        if log_request:
+            logger.info(f"Request: {scope['method']} {scope['path']}")
+        
+        # Check rate limit
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
+        
+        if rate_limiter.is_allowed(client_ip):
+            async def send_with_headers(message: Message):
+                nonlocal status_code
+                if message["type"] == "http.response.start":
+                    status_code = message["status"]
+                    # Build a new list: the app's headers may be any iterable and
+                    # may already set a security header, which ours override
+                    message["headers"] = [
+                        *(
+                            (name, value) for name, value in message.get("headers", ())
+                            if name.lower() not in SECURITY_HEADER_NAMES
+                        ),
+                        *SECURITY_HEADERS_RAW
+                    ]
+                await send(message)
+            
+            await self.app(scope, receive, send_with_headers)
+        else:
+            if logger.isEnabledFor(logging.WARNING):
+                logger.warning(f"Rate limit exceeded for IP: {client_fingerprint(client_ip)}")
+            status_code = 429
+            await send(_RATE_LIMIT_START)
+            await send(_RATE_LIMIT_RESPONSE_BODY)
+        
+        # Log response
+        if log_request:
+            process_time = time.perf_counter() - start_time
+            logger.info(f"Response: {status_code} - {process_time:.3f}s")
+
+app.add_middleware(RequestPipelineMiddleware)
 
 @app.get("/", response_model=Dict[str, str])
 async def root():
     """Root endpoint with basic information"""
-    logger.info("Root endpoint accessed")
     return {
         "message": "TradieMate Marketing Analytics Platform",
         "docs": "/docs",
@@ -137,13 +228,9 @@ async def root():
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Health check endpoint"""
-    from datetime import datetime
-    
     # Check environment variables
-    required_vars = ["OPENAI_API_KEY", "NEO4J_URI", "NEO4J_USERNAME", "NEO4J_PASSWORD"]
-    missing_vars = [var for var in required_vars if not os.getenv(var)]
-    
-    if missing_vars:
+    if missing_env_vars:
+        missing_vars = list(missing_env_vars)
         logger.warning(f"Health check failed - missing environment variables: {missing_vars}")
         raise HTTPException(
             status_code=503,
@@ -153,8 +240,8 @@ async def health_check():
     return HealthResponse(
         status="healthy",
         message="Server is running and ready to process marketing analytics queries",
-        timestamp=datetime.now().isoformat(),
-        environment=os.getenv("ENVIRONMENT", "development")
+        timestamp=now_iso(),
+        environment=security_config.environment
     )
 
 @app.post("/crewai", response_model=Dict[str, Any])
@@ -175,7 +262,8 @@ async def query_crew_endpoint(
     logger.info(f"Processing marketing query: {security_config.hash_sensitive_data(request.query)}")
     
     try:
-        result = run_crew_query(request.query)
+        # CrewAI runs synchronously; keep it off the event loop
+        result = await asyncio.to_thread(run_crew_query, request.query)
         logger.info("Marketing query processed successfully")
         return result
     except Exception as e:
@@ -187,20 +275,25 @@ async def query_crew_endpoint(
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     """Global exception handler"""
-    from datetime import datetime
-    
     logger.error(f"Unhandled exception: {str(exc)}", exc_info=True)
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content=ErrorResponse(
             error="Internal server error",
             detail="An unexpected error occurred",
-            timestamp=datetime.now().isoformat()
-        ).dict()
+            timestamp=now_iso()
+        ).model_dump()
     )
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 12000))
     host = os.getenv("HOST", "0.0.0.0")
-    uvicorn.run("main:app", host=host, port=port, reload=True)
\ No newline at end of file
+    uvicorn.run(
+        "main:app",
+        host=host,
+        port=port,
+        reload=os.getenv("ENVIRONMENT", "development") != "production",
+        backlog=2048,
+        workers=int(os.getenv("WEB_CONCURRENCY", "1"))
+    )
\ No newline at end of file
@@ -2,13 +2,16 @@
 Production security configuration for TradieMate Marketing Analytics Platform
 """
 import os
-from typing import List, Optional
+import re
+from functools import lru_cache
+from typing import FrozenSet, List, Optional
 from fastapi import HTTPException, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import secrets
 import hashlib
 import hmac
-from datetime import datetime, timedelta
+import time
+from collections import defaultdict, deque
 
 class SecurityConfig:
     """Security configuration and utilities"""
@@ -18,29 +21,36 @@ class SecurityConfig:
         self.api_key_header = "X-API-Key"
         self.rate_limit_requests = int(os.getenv("RATE_LIMIT_REQUESTS", "100"))
         self.rate_limit_window = int(os.getenv("RATE_LIMIT_WINDOW", "3600"))  # 1 hour
+        self._api_keys = frozenset(
+            key.strip() for key in os.getenv("API_KEYS", "").split(",") if key.strip()
+        )
+        # Encoded copies for constant-time comparison
+        self._api_key_bytes = tuple(key.encode() for key in self._api_keys)
+        self._allowed_origins = [
+            origin.strip() for origin in os.getenv("ALLOWED_ORIGINS", "").split(",")
+            if origin.strip()
+        ]
         
     def get_allowed_origins(self) -> List[str]:
         """Get allowed CORS origins based on environment"""
         if self.environment == "production":
-            origins = os.getenv("ALLOWED_ORIGINS", "").split(",")
-            return [origin.strip() for origin in origins if origin.strip()]
+            return list(self._allowed_origins)
         else:
             # Development - allow all origins
             return ["*"]
     
-    def get_api_keys(self) -> List[str]:
+    def get_api_keys(self) -> FrozenSet[str]:
         """Get valid API keys from environment"""
-        api_keys = os.getenv("API_KEYS", "").split(",")
-        return [key.strip() for key in api_keys if key.strip()]
+        return self._api_keys
     
     def validate_api_key(self, api_key: str) -> bool:
         """Validate API key"""
-        valid_keys = self.get_api_keys()
-        if not valid_keys:
+        if not self._api_keys:
             # If no API keys configured, allow access (development mode)
             return True
         
-        return api_key in valid_keys
+        candidate = api_key.encode()
+        return any(hmac.compare_digest(candidate, key) for key in self._api_key_bytes)
     
     def generate_api_key(self) -> str:
         """Generate a secure API key"""
@@ -48,7 +58,12 @@ class SecurityConfig:
     
     def hash_sensitive_data(self, data: str) -> str:
         """Hash sensitive data for logging"""
-        return hashlib.sha256(data.encode()).hexdigest()[:8]
+        return hashlib.blake2b(data.encode(), digest_size=4).hexdigest()
+
+@lru_cache(maxsize=1)
+def get_security_config() -> SecurityConfig:
+    """Get the shared security configuration, read from the environment once"""
+    return SecurityConfig()
 
 # Security middleware
 class APIKeyAuth(HTTPBearer):
@@ -56,7 +71,7 @@ class APIKeyAuth(HTTPBearer):
     
     def __init__(self, auto_error: bool = True):
         super().__init__(auto_error=auto_error)
-        self.security_config = SecurityConfig()
+        self.security_config = get_security_config()
     
     async def __call__(self, request: Request) -> Optional[HTTPAuthorizationCredentials]:
         # Skip authentication in development if no API keys configured
@@ -81,33 +96,42 @@ class APIKeyAuth(HTTPBearer):
 
 # Rate limiting (simple in-memory implementation)
 class RateLimiter:
-    """Simple rate limiter for API endpoints"""
+    """Sliding window rate limiter for API endpoints"""
     
     def __init__(self):
-        self.requests = {}
-        self.security_config = SecurityConfig()
+        self.security_config = get_security_config()
+        # Per-client request times, bounded by the rate limit itself
+        self.requests = defaultdict(
+            lambda: deque(maxlen=self.security_config.rate_limit_requests)
+        )
     
     def is_allowed(self, client_ip: str) -> bool:
         """Check if request is allowed based on rate limit"""
-        now = datetime.now()
-        window_start = now - timedelta(seconds=self.security_config.rate_limit_window)
+        now = time.monotonic()
+        window_start = now - self.security_config.rate_limit_window
+        request_times = self.requests[client_ip]
         
-        # Clean old entries
-        if client_ip in self.requests:
-            self.requests[client_ip] = [
-                req_time for req_time in self.requests[client_ip] 
-                if req_time > window_start
-            ]
-        else:
-            self.requests[client_ip] = []
+        # Drop requests that have left the window
+        while request_times and request_times[0] <= window_start:
+            request_times.popleft()
         
         # Check rate limit
-        if len(self.requests[client_ip]) >= self.security_config.rate_limit_requests:
+        if len(request_times) >= self.security_config.rate_limit_requests:
             return False
         
         # Add current request
-        self.requests[client_ip].append(now)
+        request_times.append(now)
         return True
+    
+    def prune(self) -> None:
+        """Forget clients with no requests left in the current window"""
+        window_start = time.monotonic() - self.security_config.rate_limit_window
+        idle_clients = [
+            client_ip for client_ip, request_times in self.requests.items()
+            if not request_times or request_times[-1] <= window_start
+        ]
+        for client_ip in idle_clients:
+            del self.requests[client_ip]
 
 # Security headers middleware
 def get_security_headers() -> dict:
@@ -121,7 +145,33 @@ def get_security_headers() -> dict:
         "Referrer-Policy": "strict-origin-when-cross-origin"
     }
 
+# Security headers pre-encoded as ASGI (name, value) pairs
+SECURITY_HEADERS_RAW = tuple(
+    (header.lower().encode("latin-1"), value.encode("latin-1"))
+    for header, value in get_security_headers().items()
+)
+SECURITY_HEADER_NAMES = frozenset(name for name, _ in SECURITY_HEADERS_RAW)
+
 # Input validation
+MALICIOUS_PATTERNS = (
+    "javascript:",
+    "<script",
+    "eval(",
+    "exec(",
+    "import(",
+    "__import__",
+    "subprocess",
+    "os.system",
+    "shell=True"
+)
+
+# All patterns compiled into one case-insensitive scan; the patterns are
+# ASCII, so ASCII-only case folding keeps the match on its fast path
+MALICIOUS_PATTERN_RE = re.compile(
+    "|".join(re.escape(pattern) for pattern in MALICIOUS_PATTERNS),
+    re.IGNORECASE | re.ASCII
+)
+
 def validate_query_input(query: str) -> bool:
     """Validate user query input for security"""
     if not query or not isinstance(query, str):
@@ -132,21 +182,4 @@ def validate_query_input(query: str) -> bool:
         return False
     
     # Check for potentially malicious patterns
-    malicious_patterns = [
-        "javascript:",
-        "<script",
-        "eval(",
-        "exec(",
-        "import(",
-        "__import__",
-        "subprocess",
-        "os.system",
-        "shell=True"
-    ]
-    
-    query_lower = query.lower()
-    for pattern in malicious_patterns:
-        if pattern in query_lower:
-            return False
-    
-    return True
\ No newline at end of file
+    return MALICIOUS_PATTERN_RE.search(query) is None
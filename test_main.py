@@ -5,23 +5,34 @@ import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
 import os
+import io
 import json
+import asyncio
+import logging
 
 # Set test environment
 os.environ["ENVIRONMENT"] = "test"
+os.environ["LOG_LEVEL"] = "CRITICAL"
 os.environ["OPENAI_API_KEY"] = "test-key"
 os.environ["NEO4J_URI"] = "neo4j://test:7687"
 os.environ["NEO4J_USERNAME"] = "test"
 os.environ["NEO4J_PASSWORD"] = "test"
 
-from main import app
+from pydantic import ValidationError
+from main import app, QueryRequest, RequestPipelineMiddleware, run_periodically
+from security_config import RateLimiter, SecurityConfig, validate_query_input
+from logging_config import BackgroundRotatingFileHandler, JsonFormatter, start_log_listener, stop_log_listener
 
-client = TestClient(app)
+@pytest.fixture(scope="session")
+def client():
+    """Test client shared by the whole suite, so app startup runs once"""
+    with TestClient(app) as test_client:
+        yield test_client
 
 class TestHealthEndpoints:
     """Test health and basic endpoints"""
     
-    def test_root_endpoint(self):
+    def test_root_endpoint(self, client):
         """Test root endpoint"""
         response = client.get("/")
         assert response.status_code == 200
@@ -31,7 +42,7 @@ class TestHealthEndpoints:
         assert "health" in data
         assert "version" in data
     
-    def test_health_check_success(self):
+    def test_health_check_success(self, client):
         """Test health check with valid environment"""
         response = client.get("/health")
         assert response.status_code == 200
@@ -40,9 +51,9 @@ class TestHealthEndpoints:
         assert "timestamp" in data
         assert "environment" in data
     
-    def test_health_check_missing_env_vars(self):
+    def test_health_check_missing_env_vars(self, client):
         """Test health check with missing environment variables"""
-        with patch.dict(os.environ, {}, clear=True):
+        with patch('main.missing_env_vars', ("OPENAI_API_KEY", "NEO4J_URI")):
             response = client.get("/health")
             assert response.status_code == 503
             assert "missing environment variables" in response.json()["detail"]
@@ -50,7 +61,7 @@ class TestHealthEndpoints:
 class TestSecurityFeatures:
     """Test security features"""
     
-    def test_security_headers(self):
+    def test_security_headers(self, client):
         """Test that security headers are present"""
         response = client.get("/")
         headers = response.headers
@@ -61,7 +72,20 @@ class TestSecurityFeatures:
         assert headers["X-Content-Type-Options"] == "nosniff"
         assert headers["X-Frame-Options"] == "DENY"
     
-    def test_cors_headers(self):
+    def test_security_headers_override_app_headers(self):
+        """Test security headers replace the app's own and accept tuple headers"""
+        app_headers = ((b"x-frame-options", b"SAMEORIGIN"), (b"x-custom", b"1"))
+        
+        async def inner_app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200, "headers": app_headers})
+            await send({"type": "http.response.body", "body": b""})
+        
+        response = TestClient(RequestPipelineMiddleware(inner_app)).get("/other")
+        assert response.headers.get_list("X-Frame-Options") == ["DENY"]
+        assert response.headers["X-Custom"] == "1"
+        assert app_headers == ((b"x-frame-options", b"SAMEORIGIN"), (b"x-custom", b"1"))
+    
+    def test_cors_headers(self, client):
         """Test CORS configuration"""
         response = client.options("/", headers={"Origin": "http://localhost:3000"})
         assert response.status_code == 200
@@ -69,7 +93,7 @@ class TestSecurityFeatures:
 class TestQueryValidation:
     """Test query input validation"""
     
-    def test_valid_query(self):
+    def test_valid_query(self, client):
         """Test valid marketing query"""
         with patch('main.run_crew_query') as mock_crew:
             mock_crew.return_value = {"result": "test result", "status": "success"}
@@ -80,12 +104,12 @@ class TestQueryValidation:
             assert response.status_code == 200
             assert mock_crew.called
     
-    def test_empty_query(self):
+    def test_empty_query(self, client):
         """Test empty query validation"""
         response = client.post("/crewai", json={"query": ""})
         assert response.status_code == 422  # Validation error
     
-    def test_malicious_query(self):
+    def test_malicious_query(self, client):
         """Test malicious query rejection"""
         malicious_queries = [
             "javascript:alert('xss')",
@@ -98,17 +122,55 @@ class TestQueryValidation:
             response = client.post("/crewai", json={"query": query})
             assert response.status_code == 422  # Validation error
     
-    def test_long_query(self):
+    def test_long_query(self, client):
         """Test overly long query rejection"""
         long_query = "a" * 1001  # Over 1000 character limit
         response = client.post("/crewai", json={"query": long_query})
         assert response.status_code == 422  # Validation error
 
+class TestQueryInputValidation:
+    """Test query validation directly, independent of endpoint auth"""
+    
+    @pytest.mark.parametrize("query", [
+        "SHELL=TRUE",
+        "run with shell=True",
+        "ExEc('code')",
+        "<SCRIPT>alert(1)</SCRIPT>",
+        "JavaScript:void(0)",
+    ])
+    def test_malicious_patterns_any_case(self, query):
+        """Test patterns are rejected regardless of case"""
+        assert not validate_query_input(query)
+    
+    def test_case_folding_is_ascii_only(self):
+        """Test non-ASCII look-alikes are not folded onto the patterns"""
+        assert validate_query_input("\u017fubprocess")  # Long s
+    
+    def test_length_boundary(self):
+        """Test the 1000 character limit"""
+        assert validate_query_input("a" * 1000)
+        assert not validate_query_input("a" * 1001)
+    
+    def test_empty_query_rejected(self):
+        """Test empty input is rejected"""
+        assert not validate_query_input("")
+    
+    def test_query_request_strips_whitespace(self):
+        """Test QueryRequest validates and returns the stripped query"""
+        assert QueryRequest(query="  top campaigns?  ").query == "top campaigns?"
+        assert QueryRequest(query="a" * 1000 + "   ").query == "a" * 1000
+    
+    @pytest.mark.parametrize("query", ["   ", "", "a" * 1001, "ExEc(x)", "SHELL=TRUE"])
+    def test_query_request_rejects_invalid(self, query):
+        """Test QueryRequest rejects invalid queries"""
+        with pytest.raises(ValidationError):
+            QueryRequest(query=query)
+
 class TestMarketingQueries:
     """Test marketing-specific query handling"""
     
     @patch('main.run_crew_query')
-    def test_google_ads_query(self, mock_crew):
+    def test_google_ads_query(self, mock_crew, client):
         """Test Google Ads optimization query"""
         mock_crew.return_value = {
             "result": "Google Ads analysis complete",
@@ -125,7 +187,7 @@ class TestMarketingQueries:
         mock_crew.assert_called_once()
     
     @patch('main.run_crew_query')
-    def test_website_optimization_query(self, mock_crew):
+    def test_website_optimization_query(self, mock_crew, client):
         """Test website optimization query"""
         mock_crew.return_value = {
             "result": "Website optimization analysis complete",
@@ -142,7 +204,7 @@ class TestMarketingQueries:
         mock_crew.assert_called_once()
     
     @patch('main.run_crew_query')
-    def test_crew_query_error_handling(self, mock_crew):
+    def test_crew_query_error_handling(self, mock_crew, client):
         """Test error handling in crew query"""
         mock_crew.side_effect = Exception("CrewAI processing error")
         
@@ -156,7 +218,7 @@ class TestMarketingQueries:
 class TestRateLimiting:
     """Test rate limiting functionality"""
     
-    def test_rate_limit_not_exceeded(self):
+    def test_rate_limit_not_exceeded(self, client):
         """Test normal request rate"""
         # Make a few requests (should be under limit)
         for _ in range(5):
@@ -164,23 +226,141 @@ class TestRateLimiting:
             assert response.status_code == 200
     
     @patch('main.rate_limiter.is_allowed')
-    def test_rate_limit_exceeded(self, mock_rate_limiter):
+    def test_rate_limit_exceeded(self, mock_rate_limiter, client):
         """Test rate limit exceeded"""
         mock_rate_limiter.return_value = False
         
         response = client.get("/health")
         assert response.status_code == 429
         assert "Rate limit exceeded" in response.json()["error"]
+    
+    def test_rate_limiter_window(self):
+        """Test the limiter enforces its window and forgets idle clients"""
+        limiter = RateLimiter()
+        limiter.security_config = SecurityConfig()
+        limiter.security_config.rate_limit_requests = 2
+        limiter.security_config.rate_limit_window = 60
+        
+        assert limiter.is_allowed("10.0.0.1")
+        assert limiter.is_allowed("10.0.0.1")
+        assert not limiter.is_allowed("10.0.0.1")
+        assert limiter.is_allowed("10.0.0.2")
+        
+        limiter.security_config.rate_limit_window = 0
+        limiter.prune()
+        assert not limiter.requests
+        assert limiter.is_allowed("10.0.0.1")
+
+class TestBackgroundTasks:
+    """Test periodic background tasks"""
+    
+    def test_run_periodically_survives_errors(self):
+        """Test a failing call does not stop later calls"""
+        calls = []
+        
+        def flaky():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError("prune failed")
+        
+        async def run():
+            task = asyncio.create_task(run_periodically(0, flaky))
+            while len(calls) < 2:
+                await asyncio.sleep(0)
+            task.cancel()
+        
+        asyncio.run(run())
+        assert len(calls) >= 2
+
+class TestLogging:
+    """Test logging configuration"""
+    
+    def test_json_formatter_keeps_exception_through_queue(self):
+        """Test queued exception records still encode as JSON with an exception field"""
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(JsonFormatter(static_fields={"service": "test"}))
+        test_logger = logging.getLogger("tradie_marketing.json_test")
+        test_logger.handlers = [handler]
+        test_logger.propagate = False
+        test_logger.setLevel(logging.INFO)
+        
+        listener = start_log_listener({"loggers": {test_logger.name: {}}})
+        try:
+            try:
+                raise ValueError('boom "quoted"')
+            except ValueError:
+                test_logger.error("Query failed: %s", "line\nbreak", exc_info=True)
+        finally:
+            stop_log_listener(listener)
+        
+        entry = json.loads(stream.getvalue())
+        assert entry["message"] == "Query failed: line\nbreak"
+        assert "ValueError: boom" in entry["exception"]
+        assert entry["service"] == "test"
+
+class TestLogRotation:
+    """Test background log rotation"""
+    
+    def test_rollovers_keep_backup_order(self, tmp_path):
+        """Test several rollovers leave backups in order once closed"""
+        log_file = tmp_path / "app.log"
+        handler = BackgroundRotatingFileHandler(str(log_file), maxBytes=100, backupCount=3)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        
+        for i in range(40):
+            handler.handle(logging.makeLogRecord({"msg": f"line {i:03d} ----------"}))
+        handler.close()
+        
+        def lines(path):
+            return [int(line.split()[1]) for line in path.read_text().splitlines()]
+        
+        assert lines(log_file) == [36, 37, 38, 39]
+        assert lines(tmp_path / "app.log.1") == [32, 33, 34, 35]
+        assert lines(tmp_path / "app.log.2") == [28, 29, 30, 31]
+        assert lines(tmp_path / "app.log.3") == [24, 25, 26, 27]
+        assert not list(tmp_path.glob("app.log.rotating.*"))
+    
+    def test_leftover_rotation_is_recovered(self, tmp_path):
+        """Test a rollover left pending by a crashed process becomes the newest backup"""
+        log_file = tmp_path / "app.log"
+        (tmp_path / "app.log.1").write_text("older\n")
+        (tmp_path / "app.log.rotating.0").write_text("leftover\n")
+        
+        handler = BackgroundRotatingFileHandler(str(log_file), maxBytes=100, backupCount=3)
+        handler.close()
+        
+        assert (tmp_path / "app.log.1").read_text() == "leftover\n"
+        assert (tmp_path / "app.log.2").read_text() == "older\n"
+        assert not list(tmp_path.glob("app.log.rotating.*"))
+    
+    def test_leftover_recovered_once_across_handlers(self, tmp_path):
+        """Test two handlers on the same file shift a leftover only once"""
+        log_file = tmp_path / "app.log"
+        for i in range(1, 4):
+            (tmp_path / f"app.log.{i}").write_text(f"backup{i}\n")
+        (tmp_path / "app.log.rotating.0").write_text("leftover\n")
+        
+        first = BackgroundRotatingFileHandler(str(log_file), maxBytes=100, backupCount=3)
+        second = BackgroundRotatingFileHandler(str(log_file), maxBytes=100, backupCount=3)
+        first.close()
+        second.close()
+        
+        assert (tmp_path / "app.log.1").read_text() == "leftover\n"
+        assert (tmp_path / "app.log.2").read_text() == "backup1\n"
+        assert (tmp_path / "app.log.3").read_text() == "backup2\n"
+        assert not list(tmp_path.glob("app.log.rotating.*"))
+        assert not list(tmp_path.glob("app.log.recovering.*"))
 
 class TestErrorHandling:
     """Test error handling"""
     
-    def test_404_endpoint(self):
+    def test_404_endpoint(self, client):
         """Test non-existent endpoint"""
         response = client.get("/nonexistent")
         assert response.status_code == 404
     
-    def test_invalid_json(self):
+    def test_invalid_json(self, client):
         """Test invalid JSON in request"""
         response = client.post("/crewai", 
                              data="invalid json",
@@ -192,20 +372,22 @@ class TestPerformance:
     """Test performance characteristics"""
     
     @patch('main.run_crew_query')
-    def test_response_time(self, mock_crew):
+    def test_response_time(self, mock_crew, client, benchmark):
         """Test response time is reasonable"""
-        import time
-        
         mock_crew.return_value = {"result": "test", "status": "success"}
         
-        start_time = time.time()
-        response = client.post("/crewai", json={
-            "query": "Test query for performance"
-        })
-        end_time = time.time()
+        # Bounded rounds so the shared client stays under the rate limit
+        response = benchmark.pedantic(
+            client.post,
+            args=("/crewai",),
+            kwargs={"json": {"query": "Test query for performance"}},
+            rounds=10
+        )
         
         assert response.status_code == 200
-        assert (end_time - start_time) < 5.0  # Should respond within 5 seconds
+        # No stats when benchmarking is disabled (--benchmark-disable, xdist)
+        if benchmark.stats is not None:
+            assert benchmark.stats.stats.max < 5.0  # Should respond within 5 seconds
 
 # Integration tests
 class TestIntegration: